@@ -3,23 +3,30 @@ import uuid
 import shutil
 import tempfile
 import asyncio
-from datetime import datetime
-from functools import lru_cache
+import time
+import contextlib
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import aiofiles
-import requests
+import httpx
+import orjson
 import postgrest.exceptions
+from cachetools import TTLCache
 
-from supabase import create_client, Client
+from supabase import acreate_client
 from models.schemas import AskRequest, UploadResponse, QAResponse, DocumentMetadata, FeedbackRequest, FeedbackResponse
 
-from utils.pdf_utils import extract_pages, chunk_pages, chunk_document_semantic, clean_text
-from utils.vector_store import build_supabase_index, get_supabase_retriever, create_local_index
-from utils.llm_utils import get_qa_chain, get_concurrent_qa_chain, create_optimized_prompt
+from utils.pdf_utils import validate_pdf, create_extract_pool
+from utils.vector_store import get_embeddings, match_document_vectors
+from utils.llm_utils import (
+    create_optimized_prompt, answer_from_documents, stream_answer_from_documents,
+    MODEL_NAME, PROMPT_VERSION
+)
+from utils.semantic_cache import SemanticCache
 
 # Load environment variables
 load_dotenv()  # expects .env in project root
@@ -30,10 +37,76 @@ SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv(
 if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
     raise RuntimeError("Supabase credentials missing (SUPABASE_URL or SERVICE_ROLE_KEY)")
 
-# Init Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# Largest PDF accepted by /upload_pdf
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# In-memory cache for document metadata
+document_cache = {}
+
+# Short-lived cache of document existence checks, keyed by document ID
+doc_exists_cache = TTLCache(maxsize=10_000, ttl=300)
+
+# Document list cache: fresh for 30s, then served stale for up to 5 minutes
+# while a single background task refreshes it
+DOCS_FRESH_TTL = 30
+DOCS_STALE_TTL = 300
+docs_cache = {"data": None, "ts": 0.0}
+docs_lock = asyncio.Lock()
+
+# Fire-and-forget tasks. The event loop only keeps weak references to tasks,
+# so this holds them until they finish.
+background_tasks_running = set()
+
+def run_in_background(coro):
+    """Schedule a coroutine without awaiting it, keeping the task alive"""
+    task = asyncio.create_task(coro)
+    background_tasks_running.add(task)
+    task.add_done_callback(background_tasks_running.discard)
+    return task
+
+# Shared HTTP client so concurrent requests reuse one HTTP/2 connection pool
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=60,
+    limits=httpx.Limits(max_keepalive_connections=20)
+)
+
+# Question log rows waiting to be batch-inserted by question_log_worker
+QUESTION_LOG_BATCH_SIZE = 50
+QUESTION_LOG_INTERVAL = 1.0
+question_log_queue: asyncio.Queue = asyncio.Queue()
+
+# Semantic cache of answered questions (disabled when REDIS_URL is unset).
+# Keys include the model and prompt template so changing either invalidates old answers.
+semantic_cache = SemanticCache(
+    os.getenv("REDIS_URL"),
+    get_embeddings,
+    namespace=f"{MODEL_NAME}:{PROMPT_VERSION}"
+)
 
-app = FastAPI(title="PDF Q&A with Gemini")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Async Supabase client shared by all handlers, so DB calls never block the event loop
+    app.state.supabase = await acreate_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    # One extraction pool for the server's lifetime; its worker processes
+    # start on the first large upload and are reused after that
+    app.state.extract_pool = create_extract_pool()
+    question_log_task = asyncio.create_task(question_log_worker())
+
+    yield
+
+    # Let the worker write everything queued so far, including any batch it
+    # is holding, then stop at the sentinel
+    question_log_queue.put_nowait(None)
+    await question_log_task
+    await http_client.aclose()
+    await asyncio.to_thread(app.state.extract_pool.shutdown)
+
+app = FastAPI(
+    title="PDF Q&A with Gemini",
+    lifespan=lifespan
+)
 
 # Add CORS middleware for better frontend integration
 app.add_middleware(
@@ -44,103 +117,134 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory cache for document metadata
-document_cache = {}
+async def sb_insert(table: str, rows):
+    """Insert one row or a list of rows through the async Supabase client"""
+    return await app.state.supabase.table(table).insert(rows).execute()
+
+async def _iter_file(file_path: str, chunk_size: int = 64 * 1024):
+    """Yield a file's contents in chunks without loading it all into memory"""
+    async with aiofiles.open(file_path, "rb") as f:
+        while chunk := await f.read(chunk_size):
+            yield chunk
 
-def upload_to_supabase_storage(file_path: str, doc_id: str, content_type: str):
+async def upload_to_supabase_storage(file_path: str, doc_id: str, content_type: str):
     """
     Upload a local file to Supabase Storage via REST API,
     bypassing RLS by providing both Authorization and apikey headers.
+    The file body is streamed so the event loop is never blocked.
     """
     url = f"{SUPABASE_URL}/storage/v1/object/pdfs/{doc_id}.pdf"
     headers = {
         "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
         "apikey": SUPABASE_SERVICE_ROLE_KEY,
         "Content-Type": content_type,
+        "Content-Length": str(os.path.getsize(file_path)),
     }
-    with open(file_path, "rb") as f:
-        resp = requests.post(url, headers=headers, data=f)
-    if not resp.ok:
+    resp = await http_client.post(url, headers=headers, content=_iter_file(file_path))
+    if not resp.is_success:
         raise Exception(f"Storage upload failed: {resp.status_code}, {resp.text}")
 
 async def save_tmp(file: UploadFile) -> str:
     """
     Save an uploaded file to a temp location and return its path.
+    The body is copied in chunks so it is never held in memory all at once.
     """
+    # Reject oversized uploads before touching the disk when the size is known
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+
     suffix = os.path.splitext(file.filename)[1]
     tmp_dir = tempfile.gettempdir()
     tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}{suffix}")
-    async with aiofiles.open(tmp_path, "wb") as out_f:
-        await out_f.write(await file.read())
+    written = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out_f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="File too large")
+                await out_f.write(chunk)
+    except BaseException:
+        # The file may not exist if opening it was what failed
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
     return tmp_path
 
 async def process_document_background(doc_id: str, tmp_path: str, filename: str):
     """
-    Process document in background for non-blocking operation
+    Process document in background for non-blocking operation.
+    Owns tmp_path and deletes it once processing finishes.
     """
+    # Imported here so API-only workers don't load the indexing stack
+    from utils.pdf_utils import extract_pages, chunk_document_semantic
+    from utils.vector_store import build_supabase_index
+    
+    # Extract text with parallel processing. Pages and chunks are
+    # generators, so each page is chunked and indexed as it streams
+    # through instead of the whole document being held in memory.
+    pages = extract_pages(tmp_path, parallel=True, executor=app.state.extract_pool)
+    
+    # Use semantic chunking for better QA results
+    chunks = chunk_document_semantic(pages)
+    
     try:
-        # Extract text with parallel processing
-        pages = extract_pages(tmp_path, parallel=True)
-        
-        # Use semantic chunking for better QA results
-        chunks = chunk_document_semantic(pages)
-        if not chunks:  # Fall back to standard chunking if semantic fails
-            chunks = chunk_pages(pages, clean=True)
-        
-        # Build vector index in batches for faster processing
-        build_supabase_index(doc_id, chunks, batch_size=20)
-        
-        # Join chunk texts to create full document content
-        full_content = " ".join([c["text"] for c in chunks])
-        
-        # Update document to mark as successfully processed
-        supabase.table("documents").update({
-            "content": full_content
-        }).eq("id", doc_id).execute()
+        # Build vector index in batches for faster processing.
+        # The chunk texts in document_vectors are the only copy of the
+        # extracted text; the documents row stays metadata-only.
+        await build_supabase_index(doc_id, chunks)
     except Exception as e:
         # Log error but don't attempt to update status column since it doesn't exist
         print(f"Document processing failed: {e}")
+    finally:
+        # Closing the generators shuts down the extraction pool if indexing
+        # stopped early; that waits on the workers, so not on the event loop
+        await asyncio.to_thread(chunks.close)
+        await asyncio.to_thread(pages.close)
+        os.remove(tmp_path)
 
 @app.post("/upload_pdf", response_model=UploadResponse)
 async def upload_pdf(file: UploadFile = File(...), background_tasks: BackgroundTasks = None):
     tmp_path = None
+    scheduled = False
     try:
         # 1. Save incoming PDF to temp
         tmp_path = await save_tmp(file)
         doc_id = uuid.uuid4().hex
 
-        # 2. Perform minimal validation on the PDF
+        # 2. Perform minimal validation on the PDF (header and page count only,
+        # text is extracted once by the background task)
         try:
-            # Just check if we can open it
-            test_pages = extract_pages(tmp_path, parallel=False)
-            if not test_pages:
-                raise HTTPException(status_code=400, detail="Invalid or empty PDF file")
+            validate_pdf(tmp_path)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid PDF: {e}")
 
         # 3. Upload PDF via REST (bypassing RLS)
         try:
-            upload_to_supabase_storage(tmp_path, doc_id, file.content_type)
+            await upload_to_supabase_storage(tmp_path, doc_id, file.content_type)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Storage upload error: {e}")
 
         # 4. Record metadata in Supabase (without status field)
-        res = supabase.table("documents").insert({
+        res = await sb_insert("documents", {
             "id": doc_id,
-            "filename": file.filename,
-            "uploaded_at": datetime.utcnow().isoformat()
-        }).execute()
+            "filename": file.filename
+        })
         
         if not res.data:
             raise HTTPException(status_code=500, detail=f"DB metadata insert failed: {res.get('error', 'Unknown error')}")
 
+        # Make the new document show up in the next listing
+        docs_cache["ts"] = 0.0
+
         # 5. Schedule background processing
         # Use background_tasks if available (in actual FastAPI app)
         if background_tasks:
             background_tasks.add_task(process_document_background, doc_id, tmp_path, file.filename)
         else:
             # Create a detached task for processing
-            asyncio.create_task(process_document_background(doc_id, tmp_path, file.filename))
+            run_in_background(process_document_background(doc_id, tmp_path, file.filename))
+        scheduled = True
 
         return UploadResponse(
             document_id=doc_id,
@@ -148,54 +252,94 @@ async def upload_pdf(file: UploadFile = File(...), background_tasks: BackgroundT
             message="Upload successful, processing started"
         )
     finally:
-        # Don't delete tmp_path here since it's used in background processing
-        # It will be deleted after processing completes
-        pass
-
-@app.post("/ask_question", response_model=QAResponse)
-async def ask_question(req: AskRequest):
-    # Check if document exists
+        # Once scheduled, the background task deletes tmp_path after processing
+        if tmp_path and not scheduled:
+            os.remove(tmp_path)
+
+async def doc_exists(doc_id: str) -> bool:
+    """Check whether a document exists, cached so hot documents skip the round-trip"""
+    exists = doc_exists_cache.get(doc_id)
+    if exists is None:
+        try:
+            await app.state.supabase.table("documents").select("id").eq("id", doc_id).single().execute()
+            exists = True
+        except postgrest.exceptions.APIError as e:
+            if e.code != 'PGRST116':  # No rows returned
+                raise
+            exists = False
+        doc_exists_cache[doc_id] = exists
+    return exists
+
+async def ensure_document_exists(doc_id: str):
+    """Raise a 404 if the document doesn't exist"""
     try:
-        doc_query = supabase.table("documents").select("id").eq("id", req.document_id).single().execute()
+        exists = await doc_exists(doc_id)
     except postgrest.exceptions.APIError as e:
-        if e.code == 'PGRST116':  # No rows returned
-            raise HTTPException(status_code=404, detail="Document not found")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if not exists:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+async def retrieve_context(doc_id: str, question: str, question_embedding=None):
+    """Find the chunks of a document most relevant to a question"""
+    # Embed the question once, reusing the embedding from the cache lookup if there is one
+    if question_embedding is None:
+        question_embedding = await get_embeddings().aembed_query(question)
 
-    # Load Supabase retriever with optimized configuration
+    # Query the vector match function directly
     try:
-        retriever = get_supabase_retriever(req.document_id, k=4)
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Document index not found: {str(e)}")
+        docs = await match_document_vectors(http_client, doc_id, question_embedding, k=4)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Vector search failed: {str(e)}")
+    return docs, question_embedding
+
+def extract_sources(docs):
+    """Source pages and context snippets to return alongside an answer"""
+    pages = set()
+    context_snippets = []
+    for i, d in enumerate(docs):
+        # Pages are stored as JSON ints in the chunk metadata
+        page = d.metadata.get("page", 0)
+        pages.add(page)
+        # Limit context snippets to top 3 most relevant for faster response
+        if i < 3:
+            context_snippets.append({"page": page, "text": d.page_content})
+    return sorted(pages), context_snippets
+
+@app.post("/ask_question", response_model=QAResponse)
+async def ask_question(req: AskRequest, background_tasks: BackgroundTasks):
+    await ensure_document_exists(req.document_id)
 
-    # Use concurrent retrieval for better performance
-    qa_chain = get_concurrent_qa_chain(retriever)
-    
     # Generate message UUID
     message_id = str(uuid.uuid4())
+
+    # Serve paraphrased or repeated questions from the semantic cache
+    hit, question_embedding = await semantic_cache.lookup(req.document_id, req.question, threshold=0.92)
+    if hit:
+        log_question(req.document_id, req.question, hit["answer"])
+        return QAResponse(
+            answer=hit["answer"],
+            source_pages=hit["pages"],
+            context_snippets=hit["snippets"],
+            message_id=message_id
+        )
+
+    docs, question_embedding = await retrieve_context(req.document_id, req.question, question_embedding)
     
     # Create optimized prompt for the question
     optimized_query = create_optimized_prompt(req.question)
     
-    # Use invoke() with the optimized query
-    result = qa_chain.invoke({"query": optimized_query})
-    
-    answer = result.get("result", "")
-    docs = result.get("source_documents", [])
+    answer = await answer_from_documents(docs, optimized_query)
+    pages, context_snippets = extract_sources(docs)
 
-    # Extract page numbers and deduplicate
-    pages = sorted({int(d.metadata.get("page", 0)) for d in docs})
-    
-    # Limit context snippets to top 3 most relevant for faster response
-    context_snippets = [
-        {"page": d.metadata.get("page"), "text": d.page_content}
-        for d in docs[:3]  # Limit to top 3 most relevant
-    ]
+    # Cache the answer after the response is sent
+    background_tasks.add_task(semantic_cache.store, req.document_id, req.question, question_embedding, {
+        "answer": answer,
+        "pages": pages,
+        "snippets": context_snippets
+    })
 
     # Log the Q&A asynchronously (don't wait for it)
-    asyncio.create_task(
-        log_question_async(req.document_id, req.question, answer)
-    )
+    log_question(req.document_id, req.question, answer)
 
     return QAResponse(
         answer=answer, 
@@ -204,28 +348,117 @@ async def ask_question(req: AskRequest):
         message_id=message_id
     )
 
-async def log_question_async(document_id: str, question: str, answer: str):
-    """Log question asynchronously without blocking the response"""
-    try:
-        supabase.table("questions").insert({
-            "document_id": document_id,
-            "question": question,
+def sse_event(data: dict) -> str:
+    """Format a server-sent event frame"""
+    return f"data: {orjson.dumps(data).decode()}\n\n"
+
+@app.post("/ask_question_stream")
+async def ask_question_stream(req: AskRequest, request: Request):
+    """
+    Same as /ask_question, but streams the answer as server-sent events.
+    Each frame is {"delta": str}; the final frame carries source_pages,
+    context_snippets and message_id with "done": true. If generation fails
+    the stream ends with an {"error": str} frame instead.
+    """
+    await ensure_document_exists(req.document_id)
+
+    message_id = str(uuid.uuid4())
+
+    hit, question_embedding = await semantic_cache.lookup(req.document_id, req.question, threshold=0.92)
+    if hit:
+        log_question(req.document_id, req.question, hit["answer"])
+
+        async def cached_stream():
+            yield sse_event({"delta": hit["answer"]})
+            yield sse_event({
+                "done": True,
+                "source_pages": hit["pages"],
+                "context_snippets": hit["snippets"],
+                "message_id": message_id
+            })
+
+        return StreamingResponse(cached_stream(), media_type="text/event-stream")
+
+    docs, question_embedding = await retrieve_context(req.document_id, req.question, question_embedding)
+    optimized_query = create_optimized_prompt(req.question)
+
+    async def event_stream():
+        parts = []
+        try:
+            async for delta in stream_answer_from_documents(docs, optimized_query):
+                # Stop generating (and paying for) tokens nobody will read
+                if await request.is_disconnected():
+                    return
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            print(f"Answer streaming failed: {e}")
+            yield sse_event({"error": "Sorry, there was an error generating the answer. Please try again."})
+            return
+
+        answer = "".join(parts)
+        pages, context_snippets = extract_sources(docs)
+        log_question(req.document_id, req.question, answer)
+
+        yield sse_event({
+            "done": True,
+            "source_pages": pages,
+            "context_snippets": context_snippets,
+            "message_id": message_id
+        })
+
+        # The client already has the whole answer; cache it on the way out
+        await semantic_cache.store(req.document_id, req.question, question_embedding, {
             "answer": answer,
-            "asked_at": datetime.utcnow().isoformat()
-        }).execute()
-    except Exception as e:
-        # Just log the error but don't fail the request
-        print(f"Failed to log question: {e}")
+            "pages": pages,
+            "snippets": context_snippets
+        })
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+def log_question(document_id: str, question: str, answer: str):
+    """Queue a question for logging without blocking the response"""
+    question_log_queue.put_nowait({
+        "document_id": document_id,
+        "question": question,
+        "answer": answer
+    })
+
+async def question_log_worker():
+    """
+    Drain the question log queue, inserting up to a batch of rows per second.
+    Returns after writing the rows queued before a None sentinel.
+    """
+    stopping = False
+    while not stopping:
+        row = await question_log_queue.get()
+        if row is None:
+            return
+        rows = [row]
+        # Give concurrent requests a moment to queue up more rows
+        await asyncio.sleep(QUESTION_LOG_INTERVAL)
+        while len(rows) < QUESTION_LOG_BATCH_SIZE and not question_log_queue.empty():
+            row = question_log_queue.get_nowait()
+            if row is None:
+                stopping = True
+                break
+            rows.append(row)
+        try:
+            await sb_insert("questions", rows)
+        except Exception as e:
+            # Just log the error but don't fail the request
+            print(f"Failed to log {len(rows)} questions: {e}")
 
 @app.get("/document_status/{doc_id}")
 async def get_document_status(doc_id: str):
     """Check if a document exists in the system"""
-    result = supabase.table("documents").select("id,filename").eq("id", doc_id).single().execute()
+    result = await app.state.supabase.table("documents").select("id,filename").eq("id", doc_id).single().execute()
     if not result.data:
         raise HTTPException(status_code=404, detail="Document not found")
     
     # Check if the document has been vectorized by checking if vectors exist
-    vector_check = supabase.table("document_vectors").select("count").eq("metadata->>document_id", doc_id).limit(1).execute()
+    vector_check = await app.state.supabase.table("document_vectors").select("count").eq("metadata->>document_id", doc_id).limit(1).execute()
     
     status = {
         "id": doc_id,
@@ -236,20 +469,38 @@ async def get_document_status(doc_id: str):
     
     return status
 
-@lru_cache(maxsize=100)
-def get_cached_documents():
+async def refresh_documents():
+    """Reload the document list into the cache, one query at a time"""
+    async with docs_lock:
+        # Another request may have refreshed the list while we waited
+        if time.monotonic() - docs_cache["ts"] < DOCS_FRESH_TTL:
+            return docs_cache["data"]
+        res = await app.state.supabase.table("documents").select("*").execute()
+        docs_cache["data"] = res.data
+        docs_cache["ts"] = time.monotonic()
+        return res.data
+
+async def get_cached_documents():
     """Cache document list to reduce database queries"""
-    return supabase.table("documents").select("*").execute().data
+    age = time.monotonic() - docs_cache["ts"]
+    if docs_cache["data"] is not None:
+        if age < DOCS_FRESH_TTL:
+            return docs_cache["data"]
+        if age < DOCS_STALE_TTL:
+            # Serve stale data while a single background task refreshes it
+            if not docs_lock.locked():
+                run_in_background(refresh_documents())
+            return docs_cache["data"]
+    return await refresh_documents()
 
 @app.get("/documents", response_model=list[DocumentMetadata])
-def list_documents():
+async def list_documents():
     """List all documents with caching for better performance"""
     try:
-        # Try to use cached data that's less than 30 seconds old
-        return get_cached_documents()
+        return await get_cached_documents()
     except Exception:
         # Fall back to direct query if caching fails
-        res = supabase.table("documents").select("*").execute()
+        res = await app.state.supabase.table("documents").select("*").execute()
         return res.data
 
 @app.get("/document/{document_id}")
@@ -279,27 +530,28 @@ def get_document(document_id: str):
         return {"error": f"Error retrieving document: {str(e)}"}
 
 @app.delete("/document/{doc_id}")
-def delete_document(doc_id: str):
+async def delete_document(doc_id: str):
     """Delete a document and all associated data"""
     try:
         # Delete from storage 
-        supabase.storage.from_("pdfs").remove([f"{doc_id}.pdf"])
+        await app.state.supabase.storage.from_("pdfs").remove([f"{doc_id}.pdf"])
         
         # Remove from vector store (via custom SQL)
-        supabase.table("document_vectors").delete().eq("metadata->>document_id", doc_id).execute()
+        await app.state.supabase.table("document_vectors").delete().eq("metadata->>document_id", doc_id).execute()
         
         # Remove metadata and questions
-        supabase.table("documents").delete().eq("id", doc_id).execute()
-        supabase.table("questions").delete().eq("document_id", doc_id).execute()
+        await app.state.supabase.table("documents").delete().eq("id", doc_id).execute()
+        await app.state.supabase.table("questions").delete().eq("document_id", doc_id).execute()
         
         # Remove from cache
         if doc_id in document_cache:
             del document_cache[doc_id]
             
-        # Clear function cache
-        get_cached_documents.cache_clear()
+        # Clear function caches
+        docs_cache["ts"] = 0.0
+        doc_exists_cache.pop(doc_id, None)
         
-        return JSONResponse({"message": "Document and related data deleted."})
+        return {"message": "Document and related data deleted."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
 
@@ -308,16 +560,16 @@ async def submit_feedback(feedback: FeedbackRequest):
     """Submit feedback for an AI response"""
     try:
         # Check if feedback already exists
-        existing = supabase.table("feedback").select("*").eq("message_id", feedback.message_id).execute()
+        existing = await app.state.supabase.table("feedback").select("*").eq("message_id", feedback.message_id).execute()
         
         if existing.data:
             # Update existing feedback
-            result = supabase.table("feedback").update({
+            result = await app.state.supabase.table("feedback").update({
                 "is_helpful": feedback.is_helpful,
             }).eq("message_id", feedback.message_id).execute()
         else:
             # Insert new feedback
-            result = supabase.table("feedback").insert({
+            result = await app.state.supabase.table("feedback").insert({
                 "message_id": feedback.message_id,
                 "is_helpful": feedback.is_helpful,
             }).execute()
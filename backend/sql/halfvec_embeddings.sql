@@ -0,0 +1,35 @@
+-- Store document embeddings as half-precision vectors (pgvector >= 0.7).
+-- halfvec halves the size of every stored vector and of the index pages
+-- read by each similarity search, with negligible recall loss.
+
+-- Drop the old index first: a vector_*_ops index can't be rebuilt on halfvec
+drop index if exists document_vectors_embedding_idx;
+
+alter table document_vectors
+    alter column embedding type halfvec(768) using embedding::halfvec(768);
+
+create index document_vectors_embedding_idx
+    on document_vectors using hnsw (embedding halfvec_cosine_ops);
+
+create or replace function match_document_vectors(
+    query_embedding vector(768),
+    filter jsonb default '{}',
+    match_count int default 4
+) returns table (
+    id uuid,
+    content text,
+    metadata jsonb,
+    similarity float
+)
+language sql stable
+as $$
+    select
+        id,
+        content,
+        metadata,
+        1 - (embedding <=> query_embedding::halfvec(768)) as similarity
+    from document_vectors
+    where metadata @> filter
+    order by embedding <=> query_embedding::halfvec(768)
+    limit match_count;
+$$;
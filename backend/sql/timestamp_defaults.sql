@@ -0,0 +1,12 @@
+-- Let Postgres stamp rows on insert instead of the API formatting
+-- timestamps for every documents/questions insert.
+
+alter table documents
+    alter column uploaded_at type timestamptz using uploaded_at::timestamptz,
+    alter column uploaded_at set default now(),
+    alter column uploaded_at set not null;
+
+alter table questions
+    alter column asked_at type timestamptz using asked_at::timestamptz,
+    alter column asked_at set default now(),
+    alter column asked_at set not null;
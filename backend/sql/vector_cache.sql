@@ -0,0 +1,8 @@
+-- Embeddings keyed by a hash of (embedding model, chunk text), so chunks
+-- that were embedded before are not sent to the embedding API again.
+
+create table if not exists vector_cache (
+    text_hash text primary key,
+    embedding halfvec(768) not null,
+    created_at timestamptz not null default now()
+);
@@ -1,28 +1,116 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import RetrievalQA
-from langchain.schema.retriever import BaseRetriever
-from langchain_community.cache import InMemoryCache
-from langchain.globals import set_llm_cache
-from typing import Optional, List
-import os
-
-# Set up caching to avoid redundant API calls
-set_llm_cache(InMemoryCache())
-
-# Initialize your Gemini-backed chat model with correct model name format
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash", 
-    temperature=0.2,
-    disable_streaming=False,  # Correct parameter name is disable_streaming
-    max_retries=2,  # Ensure resilience without excessive retries
-    timeout=30,     # Set reasonable timeout
-    cache=True      # Enable result caching
-)
+# LangChain and the Gemini SDK are imported lazily: they pull in large
+# dependency trees, and handlers that never call the LLM shouldn't pay for them.
+from typing import List, AsyncIterator, TYPE_CHECKING
+from functools import lru_cache
+import hashlib
+
+if TYPE_CHECKING:
+    from langchain.chains import RetrievalQA
+    from langchain_core.documents import Document
+    from langchain_core.retrievers import BaseRetriever
+
+# Gemini model used for answering questions
+MODEL_NAME = "gemini-2.0-flash"
+
+@lru_cache(maxsize=1)
+def get_llm():
+    """Returns the shared Gemini-backed chat model, created on first use."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langchain_core.caches import InMemoryCache
+    from langchain_core.globals import set_llm_cache
+    
+    # Set up caching to avoid redundant API calls
+    set_llm_cache(InMemoryCache())
+    
+    # Initialize your Gemini-backed chat model with correct model name format
+    return ChatGoogleGenerativeAI(
+        model=MODEL_NAME, 
+        temperature=0.2,
+        disable_streaming=False,  # Correct parameter name is disable_streaming
+        max_retries=2,  # Ensure resilience without excessive retries
+        timeout=30,     # Set reasonable timeout
+        cache=True      # Enable result caching
+    )
+
+def __getattr__(name: str):
+    # Keep `llm_utils.llm` working without creating the model at import time
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Static instructions, sent as the system message so they form an identical
+# prefix on every request
+SYSTEM_PROMPT = """You are a precise and context-aware assistant built to help users find accurate information from their uploaded PDF documents. When the user poses a question, respond with a concise and accurate answer based on the context provided. If the answer is not available in the context, respond with "The information is not available in the provided context."
+When the user asks who you are or requests an introduction, provide this response only once per session: "Hi! I'm a chat assistant built to help you find information from your uploaded documents. I was created by Suman Jana - check out his portfolio at sumanjana.xyz."
+Always prioritize checking the retrieved context first. Use only the information in the context for fact-based questions. If the answer isn't present, say: "The information is not available in the provided context." Never alter facts or make assumptions beyond what is explicitly stated. Use your own knowledge only when absolutely necessary, and only if the context is clearly insufficient. It is crucial to never contradict the context.
+Adapt your answer length to the question type; be brief for short or simple questions and detailed for complex or long-form questions. Avoid repeating information that the user already knows or that you've previously stated. If the user insists on asking multiple times for an answer not in the context, you may use prior knowledge, but clearly state: "Based on general knowledge, not from the provided context."
+"""
+
+# Per-request part of the prompt, prepended to the user's question
+_PROMPT_PRE = "Question: "
+
+_HUMAN_TEMPLATE = "Context:\n{context}\n\n{question}"
+
+# Hash of every part of the prompt sent to Gemini; answers cached under a
+# different version were produced by a different prompt
+PROMPT_VERSION = hashlib.sha1(
+    "\0".join((SYSTEM_PROMPT, _HUMAN_TEMPLATE, _PROMPT_PRE)).encode("utf-8")
+).hexdigest()[:16]
+
+@lru_cache(maxsize=1)
+def get_qa_prompt():
+    """Returns the chat prompt for answering from retrieved context."""
+    from langchain_core.prompts import ChatPromptTemplate
+    
+    return ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
+        ("human", _HUMAN_TEMPLATE),
+    ])
+
+@lru_cache(maxsize=1)
+def _get_answer_chain():
+    """Stuff-style chain that answers from already retrieved documents"""
+    return get_qa_prompt() | get_llm()
+
+def _chain_input(docs: List["Document"], query: str) -> dict:
+    # Same layout as LangChain's "stuff" documents chain
+    return {"context": "\n\n".join(d.page_content for d in docs), "question": query}
+
+async def answer_from_documents(docs: List["Document"], query: str) -> str:
+    """
+    Answers a query from already retrieved documents using the Gemini LLM.
+    
+    Args:
+        docs: The retrieved context documents
+        query: The (optimized) query to answer
+        
+    Returns:
+        The model's answer
+    """
+    chain = _get_answer_chain()
+    result = await chain.ainvoke(_chain_input(docs, query))
+    return result.content
+
+async def stream_answer_from_documents(docs: List["Document"], query: str) -> AsyncIterator[str]:
+    """
+    Streams the answer to a query token by token as Gemini generates it.
+    
+    Args:
+        docs: The retrieved context documents
+        query: The (optimized) query to answer
+        
+    Yields:
+        Pieces of the model's answer
+    """
+    chain = _get_answer_chain()
+    async for chunk in chain.astream(_chain_input(docs, query)):
+        if chunk.content:
+            yield chunk.content
 
 def get_qa_chain(
-    retriever: BaseRetriever,
+    retriever: "BaseRetriever",
     return_source_documents: bool = True
-) -> RetrievalQA:
+) -> "RetrievalQA":
     """
     Returns an optimized RetrievalQA chain using the Gemini LLM.
     
@@ -33,18 +121,21 @@ def get_qa_chain(
     Returns:
         An optimized QA chain
     """
+    from langchain.chains import RetrievalQA
+    
     return RetrievalQA.from_chain_type(
-        llm=llm,
+        llm=get_llm(),
         chain_type="stuff",
         retriever=retriever,
         return_source_documents=return_source_documents,
+        chain_type_kwargs={"prompt": get_qa_prompt()},
         verbose=False
     )
 
 def get_concurrent_qa_chain(
-    retriever: BaseRetriever,
+    retriever: "BaseRetriever",
     k: int = 4
-) -> RetrievalQA:
+) -> "RetrievalQA":
     """
     Returns a RetrievalQA chain with optimized document retrieval for better performance.
     
@@ -77,6 +168,7 @@ def get_concurrent_qa_chain(
 def create_optimized_prompt(question: str) -> str:
     """
     Creates an optimized prompt that helps the model respond more efficiently.
+    The static rules live in SYSTEM_PROMPT so only the question varies per call.
     
     Args:
         question: The user's question
@@ -84,9 +176,4 @@ def create_optimized_prompt(question: str) -> str:
     Returns:
         Optimized prompt for faster, more focused responses
     """
-    return f"""You are a precise and context-aware assistant built to help users find accurate information from their uploaded PDF documents. When the user poses a question, respond with a concise and accurate answer based on the context provided. If the answer is not available in the context, respond with "The information is not available in the provided context."
-When the user asks who you are or requests an introduction, provide this response only once per session: "Hi! I'm a chat assistant built to help you find information from your uploaded documents. I was created by Suman Jana — check out his portfolio at sumanjana.xyz."
-Always prioritize checking the retrieved context first. Use only the information in the context for fact-based questions. If the answer isn't present, say: "The information is not available in the provided context." Never alter facts or make assumptions beyond what is explicitly stated. Use your own knowledge only when absolutely necessary, and only if the context is clearly insufficient. It is crucial to never contradict the context.
-Adapt your answer length to the question type; be brief for short or simple questions and detailed for complex or long-form questions. Avoid repeating information that the user already knows or that you’ve previously stated. If the user insists on asking multiple times for an answer not in the context, you may use prior knowledge, but clearly state: "Based on general knowledge, not from the provided context." 
-Now, please provide the PDF document and ask your question: {question}.
-"""
+    return _PROMPT_PRE + question
@@ -1,55 +1,189 @@
 import fitz  # PyMuPDF
 import concurrent.futures
+import multiprocessing
+import os
 import re
-from typing import List, Dict, Optional
+from functools import lru_cache
+from collections import deque
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Dict, NamedTuple, Optional
 
+# Paragraph separator: a blank line, possibly containing whitespace
+_PARA_RE = re.compile(r'\n\s*\n')
 
-def extract_pages(path: str, parallel: bool = True) -> List[Dict]:
+# Runs of whitespace, collapsed to a single space by clean_text
+_WS_RE = re.compile(r'\s+')
+
+# Sentence boundary: whitespace after terminal punctuation, or a blank line
+_SENT_RE = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
+# Control characters that aren't whitespace, deleted by clean_text.
+# Whitespace controls (\t, \n, \x1c-\x1f, \x85, ...) are left for _WS_RE so
+# the words they separate don't get merged.
+_CTRL_TBL = dict.fromkeys(
+    c for c in chain(range(0x00, 0x20), range(0x7F, 0xA0)) if not chr(c).isspace()
+)
+
+# Below this file size, process start-up costs more than extraction itself
+PARALLEL_MIN_BYTES = 512 * 1024
+# Upper bound on extraction processes, however many cores the host reports
+MAX_EXTRACT_WORKERS = 8
+EXTRACT_WORKERS = min(os.cpu_count() or 4, MAX_EXTRACT_WORKERS)
+# Page ranges handed to each extraction process. Several smaller ranges let
+# the first pages stream out early and even out slow pages across workers.
+EXTRACT_RANGES_PER_WORKER = 4
+
+
+class Chunk(NamedTuple):
+    """A chunk of page text; a plain tuple, so it costs far less than a dict"""
+    page: int
+    text: str
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """
+    Tokenizer used to size chunks. Loaded on first use, since loading the
+    BPE ranks is slow and extraction worker processes never need it.
+    """
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def validate_pdf(path: str) -> int:
+    """
+    Cheaply checks that a file is a readable PDF without extracting any text.
+    
+    Args:
+        path: Path to the PDF file
+        
+    Returns:
+        Number of pages in the document
+        
+    Raises:
+        ValueError: If the file is not a PDF or has no pages
+    """
+    with open(path, "rb") as f:
+        if f.read(5) != b"%PDF-":
+            raise ValueError("missing PDF header")
+    
+    # Opening only parses the xref table, so this is O(1) in page content
+    with fitz.open(path) as doc:
+        if doc.page_count == 0:
+            raise ValueError("document has no pages")
+        return doc.page_count
+
+
+def create_extract_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Process pool for parallel extraction. Workers are spawned rather than
+    forked, since the server process has threads and gRPC state a forked
+    child can deadlock on. Spawning starts a fresh interpreter that also
+    re-imports the __main__ module, so create one pool per process and reuse
+    it across documents.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=EXTRACT_WORKERS,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def extract_pages(
+    path: str,
+    parallel: bool = True,
+    executor: Optional[concurrent.futures.Executor] = None
+) -> Iterator[Dict]:
     """
     Extracts text from each page of a PDF with parallel processing.
+    Pages are yielded in order as they are extracted, so callers can chunk
+    and index them without holding the whole document's text.
     
     Args:
         path: Path to the PDF file
         parallel: Whether to use parallel processing
+        executor: Long-lived pool from create_extract_pool(); without one a
+            pool is started for this document only
         
-    Returns:
-        List of {"page": int, "text": str}
+    Yields:
+        {"page": int, "text": str}
     """
-    doc = fitz.open(path)
-    pages = []
+    workers = EXTRACT_WORKERS
     
-    # For small documents, parallel processing may have overhead
-    if parallel and len(doc) > 5:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # Process pages in parallel
-            future_to_page = {
-                executor.submit(_extract_page_text, doc, i): i 
-                for i in range(len(doc))
-            }
-            
-            for future in concurrent.futures.as_completed(future_to_page):
-                page_num = future_to_page[future]
-                try:
-                    text = future.result()
-                    pages.append({"page": page_num + 1, "text": text})
-                except Exception as e:
-                    print(f"Error extracting page {page_num}: {e}")
+    with fitz.open(path) as doc:
+        page_count = len(doc)
         
-        # Sort by page number since parallel processing may complete out of order
-        pages.sort(key=lambda x: x["page"])
-    else:
-        # Sequential processing for small documents
-        for i in range(len(doc)):
-            text = doc[i].get_text()
-            pages.append({"page": i + 1, "text": text})
+        # Decide by total bytes rather than page count: many tiny pages aren't
+        # worth the process spin-up, a few dense ones are
+        if (
+            not parallel
+            or os.path.getsize(path) <= PARALLEL_MIN_BYTES
+            or page_count < workers
+        ):
+            yield from _iter_page_range(doc, 0, page_count)
+            return
+    
+    # Split pages into a few contiguous ranges per worker process
+    step = -(-page_count // (workers * EXTRACT_RANGES_PER_WORKER))
+    starts = range(0, page_count, step)
+    stops = [min(start + step, page_count) for start in starts]
     
-    doc.close()
-    return pages
+    owned = executor is None
+    if owned:
+        executor = create_extract_pool()
+    
+    # Keep one range per worker in flight, submitting the next range as each
+    # finished one is taken, so extraction can't run ahead of chunking and
+    # indexing and pile the whole document up in finished futures.
+    # Futures are consumed in submission order, so pages stay sorted.
+    ranges = zip(starts, stops)
+    pending = deque(
+        executor.submit(_extract_page_range, path, start, stop)
+        for start, stop in islice(ranges, workers)
+    )
+    try:
+        while pending:
+            pages = pending.popleft().result()
+            for start, stop in islice(ranges, 1):
+                pending.append(executor.submit(_extract_page_range, path, start, stop))
+            yield from pages
+    finally:
+        # Stopped early (e.g. indexing failed): drop ranges not started yet
+        for future in pending:
+            future.cancel()
+        if owned:
+            executor.shutdown()
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[Dict]:
+    """
+    Extract text from pages [start, stop) of a PDF.
+    Worker processes reopen the file since documents can't be shared.
+    """
+    with fitz.open(path) as doc:
+        return list(_iter_page_range(doc, start, stop))
+
+
+def _iter_page_range(doc, start: int, stop: int) -> Iterator[Dict]:
+    """Yield the text of pages [start, stop) of an open document"""
+    for i in range(start, stop):
+        try:
+            text = _extract_page_text(doc, i)
+        except Exception as e:
+            print(f"Error extracting page {i}: {e}")
+            continue
+        yield {"page": i + 1, "text": text}
 
 
 def _extract_page_text(doc, page_num):
-    """Helper function to extract text from a single page"""
-    return doc[page_num].get_text()
+    """
+    Helper function to extract text from a single page.
+    Text blocks come out of MuPDF already laid out, one paragraph each, so
+    they are joined with blank lines for chunk_document_semantic to split on.
+    Image blocks (type 1) are skipped.
+    """
+    return "\n\n".join(
+        b[4].strip() for b in doc[page_num].get_text("blocks") if b[6] == 0
+    )
 
 
 def clean_text(text: str) -> str:
@@ -62,87 +196,118 @@ def clean_text(text: str) -> str:
     Returns:
         Cleaned text
     """
+    # Remove control characters (C-level table lookup, no regex pass)
+    text = text.translate(_CTRL_TBL)
     # Replace multiple whitespace with single space
-    text = re.sub(r'\s+', ' ', text)
-    # Remove control characters
-    text = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', text)
-    return text.strip()
+    return _WS_RE.sub(' ', text).strip()
 
 
 def chunk_pages(
-    pages: List[Dict],
+    pages: Iterable[Dict],
     chunk_size: int = 512,
     overlap: int = 50,
-    clean: bool = True
-) -> List[Dict]:
+    clean: bool = False
+) -> Iterator[Chunk]:
     """
-    Splits page text into overlapping chunks of roughly chunk_size tokens.
+    Splits page text into chunks of whole sentences of up to chunk_size tokens.
+    The last one or two sentences of a chunk are repeated at the start of the
+    next one, as long as they fit within overlap tokens.
     
     Args:
-        pages: List of page dictionaries with text
-        chunk_size: Size of each chunk in approximate tokens
-        overlap: Number of overlapping tokens between chunks
-        clean: Whether to clean the text before chunking
+        pages: Page dictionaries with text, e.g. from extract_pages
+        chunk_size: Maximum size of each chunk in tokens
+        overlap: Maximum number of tokens carried over between chunks
+        clean: Whether to clean the text before chunking; block-extracted
+            page text only needs its whitespace collapsed, which the
+            sentence split does anyway
         
-    Returns:
-        List of {"page": int, "text": chunk_text}
+    Yields:
+        Chunk(page, text)
     """
-    chunks = []
+    enc = _get_encoding()
     
     for p in pages:
-        text = clean_text(p["text"]) if clean else p["text"]
-        words = text.split()
+        if clean:
+            # Keep the cleaned text on the page so another pass over the same
+            # pages (e.g. comparing chunk sizes) doesn't clean it again
+            text = p.get("_cleaned")
+            if text is None:
+                text = p["_cleaned"] = clean_text(p["text"])
+        else:
+            text = p["text"]
+        split = [" ".join(s.split()) for s in _SENT_RE.split(text)]
+        split = [s for s in split if s]
         
-        # Skip empty pages
-        if not words:
-            continue
-            
-        start = 0
-        while start < len(words):
-            end = min(start + chunk_size, len(words))
-            chunk_text = " ".join(words[start:end])
-            
-            # Skip empty chunks
-            if chunk_text.strip():
-                chunks.append({"page": p["page"], "text": chunk_text})
+        # (text, token count) per sentence; a sentence longer than a whole
+        # chunk is cut into chunk_size-token pieces
+        sentences = []
+        for sentence in split:
+            tokens = enc.encode_ordinary(sentence)
+            if len(tokens) <= chunk_size:
+                sentences.append((sentence, len(tokens)))
+                continue
+            for i in range(0, len(tokens), chunk_size):
+                piece = tokens[i:i + chunk_size]
+                sentences.append((enc.decode(piece).strip(), len(piece)))
+        
+        # Greedily pack sentences into chunks
+        current = []
+        current_length = 0
+        for sentence, length in sentences:
+            if current and current_length + length > chunk_size:
+                yield Chunk(p["page"], " ".join(s for s, _ in current))
                 
-            start += chunk_size - overlap
+                # Carry up to two trailing sentences into the next chunk
+                carry = []
+                carry_length = 0
+                for prev, prev_length in reversed(current[-2:]):
+                    if carry_length + prev_length > overlap:
+                        break
+                    carry.insert(0, (prev, prev_length))
+                    carry_length += prev_length
+                if carry_length + length > chunk_size:
+                    carry, carry_length = [], 0
+                current, current_length = carry, carry_length
             
-    return chunks
+            current.append((sentence, length))
+            current_length += length
+        
+        if current:
+            yield Chunk(p["page"], " ".join(s for s, _ in current))
 
 
-def chunk_document_semantic(pages: List[Dict], max_chunk_size: int = 512) -> List[Dict]:
+def chunk_document_semantic(pages: Iterable[Dict], max_chunk_size: int = 512) -> Iterator[Chunk]:
     """
     Alternative chunking method that tries to maintain semantic sections.
     Uses paragraph and section breaks instead of fixed-size chunks.
     
     Args:
-        pages: List of page dictionaries with text
-        max_chunk_size: Maximum size of each chunk in approximate tokens
+        pages: Page dictionaries with text, e.g. from extract_pages
+        max_chunk_size: Maximum size of each chunk in tokens
         
-    Returns:
-        List of {"page": int, "text": chunk_text}
+    Yields:
+        Chunk(page, text)
     """
-    chunks = []
+    enc = _get_encoding()
     
     for p in pages:
         text = p["text"]
         
         # Split by paragraphs (double newlines)
-        paragraphs = re.split(r'\n\s*\n', text)
+        paragraphs = _PARA_RE.split(text)
+        paragraphs = [para.strip() for para in paragraphs]
+        paragraphs = [para for para in paragraphs if para]
         current_chunk = ""
         current_length = 0
         
-        for para in paragraphs:
-            para = para.strip()
-            if not para:
-                continue
-                
-            para_length = len(para.split())
-            
+        # Encoded one by one: the batch API starts a thread pool per call,
+        # which costs more than encoding a page's paragraphs
+        lengths = [len(enc.encode_ordinary(para)) for para in paragraphs]
+        
+        for para, para_length in zip(paragraphs, lengths):
             # If this paragraph would make the chunk too big, store current chunk and start new one
             if current_length + para_length > max_chunk_size and current_chunk:
-                chunks.append({"page": p["page"], "text": current_chunk.strip()})
+                yield Chunk(p["page"], current_chunk.strip())
                 current_chunk = para
                 current_length = para_length
             else:
@@ -155,6 +320,4 @@ def chunk_document_semantic(pages: List[Dict], max_chunk_size: int = 512) -> Lis
         
         # Add any remaining text
         if current_chunk:
-            chunks.append({"page": p["page"], "text": current_chunk.strip()})
-    
-    return chunks
+            yield Chunk(p["page"], current_chunk.strip())
@@ -0,0 +1,221 @@
+import re
+import unicodedata
+from typing import Callable, Dict, List, Optional, Tuple
+
+import msgpack
+import numpy as np
+import xxhash
+
+# Matches runs of whitespace for question normalization
+_WS_RE = re.compile(r"\s+")
+# Characters that must be escaped inside a RediSearch TAG query
+_TAG_ESCAPE_RE = re.compile(r"([^A-Za-z0-9_])")
+# Trailing punctuation that doesn't change what is being asked
+_TRAILING_PUNCT = "?!.,;: "
+
+
+def normalize_question(question: str) -> str:
+    """NFC-normalize and lowercase a question, collapse its whitespace and strip trailing punctuation."""
+    text = unicodedata.normalize("NFC", question).lower()
+    return _WS_RE.sub(" ", text).strip().rstrip(_TRAILING_PUNCT)
+
+
+class SemanticCache:
+    """
+    Redis-backed cache of answered questions, keyed per document.
+
+    Lookups first try an exact match on an xxhash of the normalized
+    question and then fall back to a RediSearch HNSW vector search over
+    question embeddings, so paraphrased questions can reuse a previous
+    answer. All keys are scoped by a namespace (model and prompt version)
+    so prompt or model changes invalidate old answers automatically.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str],
+        get_embeddings: Callable,
+        index_name: str = "qa_cache_idx",
+        prefix: str = "qa:",
+        dim: int = 768,
+        ttl: int = 86400,
+        namespace: str = ""
+    ):
+        """
+        Args:
+            redis_url: Redis connection URL; the cache is disabled when empty
+            get_embeddings: Factory returning the embeddings model used to
+                embed questions; called on first use
+            index_name: Name of the RediSearch index
+            prefix: Key prefix of the cached hashes
+            dim: Dimension of the question embeddings
+            ttl: Expiry of cached entries in seconds
+            namespace: Model/prompt version that cached answers belong to
+        """
+        self.redis = None
+        if redis_url:
+            # Imported only when the cache is configured
+            from redis import asyncio as aioredis
+            self.redis = aioredis.from_url(redis_url)
+        self._get_embeddings = get_embeddings
+        self.index_name = index_name
+        self.prefix = prefix
+        self.dim = dim
+        self.ttl = ttl
+        self.namespace = namespace
+        self._index_ready = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.redis is not None
+
+    @property
+    def embeddings(self):
+        return self._get_embeddings()
+
+    def _digest(self, document_id: str, normalized: str) -> str:
+        return xxhash.xxh64(f"{self.namespace}|{document_id}|{normalized}").hexdigest()
+
+    def _exact_key(self, digest: str) -> str:
+        return f"{self.prefix}exact:{digest}"
+
+    def _entry_key(self, digest: str) -> str:
+        return f"{self.prefix}{digest}"
+
+    async def _ensure_index(self):
+        """Create the HNSW vector index if it doesn't exist yet."""
+        if self._index_ready:
+            return
+        from redis.exceptions import ResponseError
+        from redis.commands.search.field import TagField, VectorField
+        try:
+            from redis.commands.search.index_definition import IndexDefinition, IndexType
+        except ImportError:  # older redis-py
+            from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+        
+        try:
+            await self.redis.ft(self.index_name).create_index(
+                [
+                    TagField("namespace"),
+                    TagField("document_id"),
+                    VectorField("emb", "HNSW", {
+                        "TYPE": "FLOAT32",
+                        "DIM": self.dim,
+                        "DISTANCE_METRIC": "COSINE",
+                    }),
+                ],
+                definition=IndexDefinition(prefix=[self.prefix], index_type=IndexType.HASH)
+            )
+        except ResponseError as e:
+            if "already exists" not in str(e).lower():
+                raise
+        self._index_ready = True
+
+    async def lookup(
+        self,
+        document_id: str,
+        question: str,
+        threshold: float = 0.92
+    ) -> Tuple[Optional[Dict], Optional[List[float]]]:
+        """
+        Look up a cached answer for a question about a document.
+
+        Args:
+            document_id: Document the question is about
+            question: The user's question
+            threshold: Minimum cosine similarity for a semantic hit
+
+        Returns:
+            A tuple of (hit, embedding). hit is a dict with answer, pages and
+            snippets or None on a miss; embedding is the embedding of the raw
+            question computed for the vector search, to be reused for
+            retrieval and passed back to store().
+        """
+        if not self.enabled:
+            return None, None
+
+        try:
+            normalized = normalize_question(question)
+
+            # Exact match on the normalized question skips the embedding call
+            payload = await self.redis.get(self._exact_key(self._digest(document_id, normalized)))
+            if payload:
+                return msgpack.unpackb(payload), None
+
+            from redis.commands.search.query import Query
+            
+            await self._ensure_index()
+            # Embed the question as asked (not normalized) so retrieval can
+            # reuse this embedding and match what it would compute itself
+            embedding = await self.embeddings.aembed_query(question)
+            namespace = _TAG_ESCAPE_RE.sub(r"\\\1", self.namespace or "default")
+            tag = _TAG_ESCAPE_RE.sub(r"\\\1", document_id)
+            query = (
+                Query(f"(@namespace:{{{namespace}}} @document_id:{{{tag}}})=>[KNN 1 @emb $vec AS score]")
+                .sort_by("score")
+                .return_fields("score")
+                .dialect(2)
+            )
+            res = await self.redis.ft(self.index_name).search(
+                query,
+                query_params={"vec": np.asarray(embedding, dtype=np.float32).tobytes()}
+            )
+
+            # COSINE distance is 1 - similarity
+            if not res.docs or 1.0 - float(res.docs[0].score) < threshold:
+                return None, embedding
+
+            # The vector entry points at the answer stored under the same digest
+            payload = await self.redis.get(self._exact_key(res.docs[0].id[len(self.prefix):]))
+        except Exception as e:
+            # The cache must never fail a request
+            print(f"Semantic cache lookup failed: {e}")
+            return None, None
+
+        if payload:
+            return msgpack.unpackb(payload), embedding
+        return None, embedding
+
+    async def store(
+        self,
+        document_id: str,
+        question: str,
+        embedding: Optional[List[float]],
+        result: Dict
+    ) -> None:
+        """
+        Store an answered question in the cache.
+
+        Args:
+            document_id: Document the question is about
+            question: The user's question
+            embedding: Question embedding returned by lookup(), if any
+            result: Dict with answer, pages and snippets
+        """
+        if not self.enabled:
+            return
+
+        try:
+            normalized = normalize_question(question)
+            digest = self._digest(document_id, normalized)
+            # The answer is stored once, as msgpack under the exact-match key
+            await self.redis.set(
+                self._exact_key(digest),
+                msgpack.packb(result, use_bin_type=True),
+                ex=self.ttl
+            )
+
+            if embedding is None:
+                embedding = await self.embeddings.aembed_query(question)
+            await self._ensure_index()
+
+            key = self._entry_key(digest)
+            await self.redis.hset(key, mapping={
+                "namespace": self.namespace or "default",
+                "document_id": document_id,
+                "question": normalized,
+                "emb": np.asarray(embedding, dtype=np.float32).tobytes(),
+            })
+            await self.redis.expire(key, self.ttl)
+        except Exception as e:
+            print(f"Semantic cache store failed: {e}")
@@ -1,85 +1,250 @@
 import os
+import uuid
+import random
+import asyncio
 import hashlib
+import threading
+import warnings
 from functools import lru_cache
 import concurrent.futures
 
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import SupabaseVectorStore, FAISS
-from supabase import create_client
-from typing import List, Dict, Optional, Union
+import numpy as np
+
+import httpx
+from itertools import islice
+from typing import Iterable, List, Dict, Optional, Tuple, Union, TYPE_CHECKING
 from dotenv import load_dotenv
 
+# LangChain, the Gemini SDK and the Supabase client are imported where they
+# are first needed, so the API process can import this module (for
+# match_document_vectors) without loading the indexing stack.
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+    from langchain_community.vectorstores import FAISS, SupabaseVectorStore
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
 # Load environment variables
 load_dotenv()
 
 # Supabase configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
-supabase_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-
-# Initialize embeddings with explicit API key
-google_api_key = os.environ.get("GOOGLE_API_KEY")
-if not google_api_key:
-    raise ValueError("GOOGLE_API_KEY environment variable is not set")
 
 # Use the correct model name format with full path for embeddings
-embeddings = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001",  # Use the fully qualified model name
-    google_api_key=google_api_key,
-)
+EMBEDDING_MODEL = "models/embedding-001"
+
+# The client and embedder are created on first use rather than at import, so
+# importing this module is cheap and needs no credentials
+@lru_cache(maxsize=1)
+def get_supabase_client():
+    """Shared synchronous Supabase client"""
+    from supabase import create_client
+    
+    return create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> "GoogleGenerativeAIEmbeddings":
+    """
+    Shared embeddings model, initialized with an explicit API key.
+    langchain-google-genai 4.x sends embed_query/aembed_query to the
+    single-text endpoint with the RETRIEVAL_QUERY task type.
+    """
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    
+    google_api_key = os.environ.get("GOOGLE_API_KEY")
+    if not google_api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set")
+    
+    return GoogleGenerativeAIEmbeddings(
+        model=EMBEDDING_MODEL,  # Use the fully qualified model name
+        google_api_key=google_api_key,
+    )
 
 # Use a separate table for vector embeddings
 VECTOR_TABLE = "document_vectors"
 VECTOR_QUERY_FUNCTION = "match_document_vectors"
 
-# In-memory cache for frequently accessed retriever instances
+# Maximum number of texts per embedding request (Google's batch limit)
+EMBED_BATCH_SIZE = 100
+
+# Maximum number of rows sent in a single insert request
+INSERT_BATCH_SIZE = 500
+
+# Embedding requests in flight at once, and attempts per batch
+EMBED_CONCURRENCY = 4
+EMBED_MAX_RETRIES = 3
+
+# Persistent cache of chunk embeddings keyed by content hash, so re-ingesting
+# the same text skips the embedding API (see sql/vector_cache.sql)
+EMBEDDING_CACHE_TABLE = "vector_cache"
+# Hashes per lookup request, keeping the PostgREST `in` filter URL short
+CACHE_LOOKUP_BATCH_SIZE = 200
+
+# In-memory cache for frequently accessed retriever instances; the lock keeps
+# concurrent requests from racing on it
 retriever_cache = {}
+retriever_cache_lock = threading.Lock()
+
+def _to_halfvec(vector: List[float]) -> str:
+    """
+    Format an embedding as a pgvector halfvec literal.
+    Rounding to float16 here keeps the request body small; the column
+    stores half-precision values anyway (see sql/halfvec_embeddings.sql).
+    """
+    return "[" + ",".join(map(str, np.asarray(vector, dtype=np.float16))) + "]"
+
+def _text_hash(text: str) -> str:
+    """Content hash of a chunk, scoped to the embedding model that embeds it"""
+    return hashlib.blake2b(f"{EMBEDDING_MODEL}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+async def _load_cached_embeddings(hashes: List[str]) -> Dict[str, str]:
+    """Look up cached embeddings, returning {text_hash: halfvec literal}"""
+    cached = {}
+    try:
+        for i in range(0, len(hashes), CACHE_LOOKUP_BATCH_SIZE):
+            res = await asyncio.to_thread(
+                get_supabase_client().table(EMBEDDING_CACHE_TABLE)
+                .select("text_hash,embedding")
+                .in_("text_hash", hashes[i:i + CACHE_LOOKUP_BATCH_SIZE])
+                .execute
+            )
+            cached.update((row["text_hash"], row["embedding"]) for row in res.data)
+    except Exception as e:
+        # A cache failure only costs extra embedding calls
+        print(f"Embedding cache lookup failed: {e}")
+    return cached
+
+async def _store_cached_embeddings(halfvecs: Dict[str, str]) -> None:
+    """Add newly computed embeddings to the cache"""
+    rows = [{"text_hash": h, "embedding": v} for h, v in halfvecs.items()]
+    try:
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            await asyncio.to_thread(
+                get_supabase_client().table(EMBEDDING_CACHE_TABLE)
+                .upsert(rows[i:i + INSERT_BATCH_SIZE], on_conflict="text_hash", ignore_duplicates=True)
+                .execute
+            )
+    except Exception as e:
+        print(f"Embedding cache store failed: {e}")
 
 def _chunk_processor(chunk_batch):
     """Process a batch of chunks for parallel embedding"""
-    return embeddings.embed_documents([c["text"] for c in chunk_batch])
+    return get_embeddings().embed_documents([text for _, text in chunk_batch])
+
+async def _embed_batch(texts: List[str], semaphore: asyncio.Semaphore) -> List[List[float]]:
+    """Embed one batch of texts, retrying with backoff on failure"""
+    async with semaphore:
+        for attempt in range(EMBED_MAX_RETRIES):
+            # Jitter so concurrent batches don't hit the rate limiter in lockstep
+            await asyncio.sleep(random.random() * 0.05)
+            try:
+                return await get_embeddings().aembed_documents(texts)
+            except Exception as e:
+                if attempt == EMBED_MAX_RETRIES - 1:
+                    raise
+                print(f"Embedding batch failed (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
 
-def build_supabase_index(
+async def build_supabase_index(
     document_id: str,
-    chunks: List[Dict],
-    batch_size: int = 20
+    chunks: Iterable[Tuple[int, str]],
+    batch_size: int = EMBED_BATCH_SIZE
 ) -> None:
     """
-    Given a list of {"page": int, "text": str}, build & save a Supabase index.
-    Uses batching and parallelization for faster processing.
+    Given an iterable of (page, text) chunks, build & save a Supabase index.
+    Embeds chunks with concurrent batched embedding calls and bulk-inserts the rows.
+    Chunks whose text was embedded before are served from the embedding cache.
     
     Args:
         document_id: Unique ID for the document
-        chunks: List of text chunks with page numbers
-        batch_size: Number of chunks to process in parallel
+        chunks: Text chunks with page numbers; may be a generator, which is
+            consumed a window at a time
+        batch_size: Number of chunks embedded per embedding API call
     """
-    texts = [c["text"] for c in chunks]
+    chunks = iter(chunks)
+    window_size = batch_size * EMBED_CONCURRENCY
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    
+    # Index one window at a time, just large enough to keep every embedding
+    # slot busy, so the document's chunks are never all held in memory.
+    # Pulling a window runs PDF extraction and tokenization, so it happens in
+    # a worker thread to keep the event loop free.
+    while window := await asyncio.to_thread(lambda: list(islice(chunks, window_size))):
+        await _index_window(document_id, window, batch_size, semaphore)
+
+async def _index_window(
+    document_id: str,
+    chunks: List[Tuple[int, str]],
+    batch_size: int,
+    semaphore: asyncio.Semaphore
+) -> None:
+    """Embed and insert one window of chunks for build_supabase_index"""
+    texts = [text for _, text in chunks]
     
     # Include only necessary metadata to avoid conflicts
     metadatas = [
         {
             "document_id": document_id, 
-            "page": c["page"]
+            "page": page
         } 
-        for c in chunks
+        for page, _ in chunks
     ]
 
-    # Process in batches for better efficiency
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i + batch_size]
-        batch_meta = metadatas[i:i + batch_size]
-        
-        # This will handle the vector embeddings and storage
-        SupabaseVectorStore.from_texts(
-            batch_texts,
-            embeddings,
-            metadatas=batch_meta,
-            client=supabase_client,
-            table_name=VECTOR_TABLE,
-            query_name=VECTOR_QUERY_FUNCTION
+    # Reuse embeddings of any text seen before (e.g. a re-uploaded document).
+    # Keying by hash also collapses chunks repeated within the window; repeats
+    # in later windows (running headers/footers) hit the cache entries stored
+    # below, so each distinct text is embedded once.
+    hashes = [_text_hash(t) for t in texts]
+    text_by_hash = dict(zip(hashes, texts))
+    halfvecs = await _load_cached_embeddings(list(text_by_hash))
+    missing = [h for h in text_by_hash if h not in halfvecs]
+    missing_texts = [text_by_hash[h] for h in missing]
+    
+    # Embed in batches so each API call covers many chunks, with a bounded
+    # number of batches in flight; gather() keeps the results in order
+    batches = await asyncio.gather(*(
+        _embed_batch(missing_texts[i:i + batch_size], semaphore)
+        for i in range(0, len(missing_texts), batch_size)
+    ))
+    new_halfvecs = {
+        h: _to_halfvec(vector)
+        for h, vector in zip(missing, (vector for batch in batches for vector in batch))
+    }
+    await _store_cached_embeddings(new_halfvecs)
+    halfvecs.update(new_halfvecs)
+    
+    # Store the embeddings as half-precision vectors
+    rows = [
+        {
+            "id": str(uuid.uuid4()),
+            "content": text,
+            "metadata": meta,
+            "embedding": halfvecs[h]
+        }
+        for text, meta, h in zip(texts, metadatas, hashes)
+    ]
+    
+    # Bulk insert instead of one request per embedding batch
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        await asyncio.to_thread(
+            get_supabase_client().table(VECTOR_TABLE).insert(rows[i:i + INSERT_BATCH_SIZE]).execute
         )
 
-@lru_cache(maxsize=10)
+@lru_cache(maxsize=1)
+def get_vector_store() -> "SupabaseVectorStore":
+    """
+    Shared LangChain vector store over the vectors table. It holds no
+    per-document state, so one instance serves every retriever.
+    """
+    from langchain_community.vectorstores import SupabaseVectorStore
+    
+    return SupabaseVectorStore(
+        embedding=get_embeddings(),
+        client=get_supabase_client(),
+        table_name=VECTOR_TABLE,
+        query_name=VECTOR_QUERY_FUNCTION
+    )
+
 def get_supabase_retriever(document_id: str, k: int = 4):
     """
     Load a previously built Supabase index for a document_id.
@@ -94,29 +259,68 @@ def get_supabase_retriever(document_id: str, k: int = 4):
     """
     # Check if we have a cached retriever for this document
     cache_key = f"{document_id}_{k}"
-    if cache_key in retriever_cache:
-        return retriever_cache[cache_key]
+    with retriever_cache_lock:
+        if cache_key in retriever_cache:
+            return retriever_cache[cache_key]
+        
+        # Create a new retriever if not cached
+        retriever = get_vector_store().as_retriever(search_kwargs={
+            "filter": {"document_id": document_id},
+            "k": k
+            # Removed fetch_k parameter as it's not supported by SupabaseVectorStore
+        })
+        
+        # Cache the retriever
+        retriever_cache[cache_key] = retriever
+        return retriever
+
+async def match_document_vectors(
+    http_client: httpx.AsyncClient,
+    document_id: str,
+    query_embedding: List[float],
+    k: int = 4
+) -> List["Document"]:
+    """
+    Find the chunks of a document most similar to a query embedding.
+    Calls the match function over PostgREST directly, skipping the
+    LangChain retriever/vectorstore layers and the embedding call inside them.
     
-    # Create a new retriever if not cached
-    retriever = SupabaseVectorStore(
-        embedding=embeddings,
-        client=supabase_client,
-        table_name=VECTOR_TABLE,
-        query_name=VECTOR_QUERY_FUNCTION
-    ).as_retriever(search_kwargs={
-        "filter": {"document_id": document_id},
-        "k": k
-        # Removed fetch_k parameter as it's not supported by SupabaseVectorStore
-    })
+    Args:
+        http_client: Shared async HTTP client
+        document_id: Unique ID for the document
+        query_embedding: Embedding of the user's question
+        k: Number of documents to retrieve (default: 4)
     
-    # Cache the retriever
-    retriever_cache[cache_key] = retriever
-    return retriever
+    Returns:
+        The matching chunks, most similar first
+    """
+    resp = await http_client.post(
+        f"{SUPABASE_URL}/rest/v1/rpc/{VECTOR_QUERY_FUNCTION}",
+        headers={
+            "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+            "apikey": SUPABASE_SERVICE_ROLE_KEY,
+        },
+        json={
+            "query_embedding": query_embedding,
+            "filter": {"document_id": document_id},
+            "match_count": k
+        }
+    )
+    resp.raise_for_status()
+    
+    from langchain_core.documents import Document
+    return [
+        Document(page_content=row["content"], metadata=row["metadata"])
+        for row in resp.json()
+    ]
 
-def create_local_index(document_id: str, chunks: List[Dict]):
+def create_local_index(document_id: str, chunks: List[Tuple[int, str]]) -> "FAISS":
     """
     Create a local FAISS index for faster testing and development.
     This can be used as a fallback when Supabase is slow.
+    Vectors are L2-normalized and stored as float16 in an inner-product
+    index, so search ranks by cosine similarity at half the memory of the
+    default float32 L2 index.
     
     Args:
         document_id: Unique ID for the document
@@ -125,7 +329,35 @@ def create_local_index(document_id: str, chunks: List[Dict]):
     Returns:
         A FAISS vector store
     """
-    texts = [c["text"] for c in chunks]
-    metadatas = [{"document_id": document_id, "page": c["page"]} for c in chunks]
+    import faiss
+    from langchain_core.documents import Document
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.vectorstores.utils import DistanceStrategy
     
-    return FAISS.from_texts(texts, embeddings, metadatas=metadatas)
+    texts = [text for _, text in chunks]
+    metadatas = [{"document_id": document_id, "page": page} for page, _ in chunks]
+    
+    vectors = np.asarray(get_embeddings().embed_documents(texts), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexScalarQuantizer(
+        vectors.shape[1], faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+    )
+    index.add(vectors)
+    
+    ids = [str(uuid.uuid4()) for _ in texts]
+    with warnings.catch_warnings():
+        # LangChain warns that normalize_L2 only suits L2 distance, but it is
+        # what makes inner product equal cosine for queries and later add_texts
+        warnings.filterwarnings("ignore", message="Normalizing L2 is not applicable")
+        return FAISS(
+            embedding_function=get_embeddings(),
+            index=index,
+            docstore=InMemoryDocstore({
+                doc_id: Document(page_content=text, metadata=meta)
+                for doc_id, text, meta in zip(ids, texts, metadatas)
+            }),
+            index_to_docstore_id=dict(enumerate(ids)),
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+            normalize_L2=True
+        )
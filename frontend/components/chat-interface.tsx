@@ -168,7 +168,7 @@ export default function ChatInterface({ document }: ChatInterfaceProps) {
     setIsLoading(true)
 
     try {
-      const response = await fetch("https://fileai.onrender.com/ask_question", {
+      const response = await fetch("https://fileai.onrender.com/ask_question_stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -179,21 +179,75 @@ export default function ChatInterface({ document }: ChatInterfaceProps) {
         }),
       })
 
-      if (response.ok) {
-        const data = await response.json()
-        const assistantMessage: Message = {
-          id: data.message_id || uuidv4(), // Use response message_id or generate UUID
-          role: "assistant",
-          content: data.answer,
-          timestamp: new Date(),
-          sourcePages: data.source_pages,
-          contextSnippets: data.context_snippets.map((snippet: any) => ({
-            page: snippet.page,
-            text: snippet.text,
-          })),
+      if (response.ok && response.body) {
+        // Render the answer as server-sent events arrive
+        const assistantId = uuidv4()
+        const reader = response.body.getReader()
+        const decoder = new TextDecoder()
+        let buffer = ""
+        let content = ""
+        let created = false
+
+        // Add the assistant message on the first frame of any kind, replacing
+        // the "Thinking..." indicator, so empty answers still show their sources
+        const ensureMessage = () => {
+          if (created) return
+          created = true
+          setIsLoading(false)
+          setMessages((prev) => [
+            ...prev,
+            { id: assistantId, role: "assistant", content: "", timestamp: new Date() },
+          ])
         }
 
-        setMessages((prev) => [...prev, assistantMessage])
+        while (true) {
+          const { done, value } = await reader.read()
+          if (done) break
+
+          buffer += decoder.decode(value, { stream: true })
+          const frames = buffer.split("\n\n")
+          buffer = frames.pop() ?? ""
+
+          for (const frame of frames) {
+            if (!frame.startsWith("data: ")) continue
+            const data = JSON.parse(frame.slice(6))
+
+            if (data.delta) {
+              ensureMessage()
+              content += data.delta
+              const text = content
+              setMessages((prev) => prev.map((m) => (m.id === assistantId ? { ...m, content: text } : m)))
+            }
+
+            if (data.error) {
+              // Generation failed mid-stream: keep any partial answer and flag it
+              ensureMessage()
+              const text = content ? `${content}\n\n${data.error}` : data.error
+              setMessages((prev) =>
+                prev.map((m) => (m.id === assistantId ? { ...m, content: text, error: true } : m)),
+              )
+            }
+
+            if (data.done) {
+              ensureMessage()
+              setMessages((prev) =>
+                prev.map((m) =>
+                  m.id === assistantId
+                    ? {
+                        ...m,
+                        id: data.message_id || assistantId, // Use response message_id for feedback
+                        sourcePages: data.source_pages,
+                        contextSnippets: data.context_snippets.map((snippet: any) => ({
+                          page: snippet.page,
+                          text: snippet.text,
+                        })),
+                      }
+                    : m,
+                ),
+              )
+            }
+          }
+        }
       } else {
         const errorMessage: Message = {
           id: uuidv4(), // Generate UUID for error message